@@ -0,0 +1,129 @@
+"""Times fresh vs pooled YoutubeDL per item.
+
+Usage: python bench_pool.py urls.txt [--no-download] [--concurrent] [--rounds N]
+
+urls.txt holds one video URL per line (e.g. a batch of 50). Every run gets
+its own temp dir for downloads and for yt-dlp's cache, so neither mode
+starts with files or solved signatures left by the other. The order of the
+two modes alternates between rounds. --concurrent starts every item at once
+in its own thread, like the app's download button does.
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import yt_dlp
+
+from main import YoutubeDLPool
+
+
+def make_opts(home: Path) -> dict:
+    return {
+        'format': 'best[ext=mp4]/best',
+        'outtmpl': "%(title)s.%(ext)s",
+        'paths': {'home': str(home), 'temp': str(home / ".partial")},
+        'cachedir': str(home / ".cache"),
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+
+def run_item(ydl: yt_dlp.YoutubeDL, url: str, download: bool) -> bool:
+    try:
+        info = ydl.extract_info(url, download=False)
+        if download:
+            ydl.process_ie_result(info, download=True)
+    except yt_dlp.utils.DownloadError:
+        return False
+    return True
+
+
+def run_batch(urls: list[str], item: callable, concurrent: bool) -> tuple[float, list[float], int]:
+    """Runs item(url) for every url, returns wall time, per-item times and failures"""
+    times: list[float] = []
+    failures = 0
+    lock = threading.Lock()
+
+    def timed(url: str):
+        nonlocal failures
+        start = time.perf_counter()
+        ok = item(url)
+        with lock:
+            times.append(time.perf_counter() - start)
+            failures += not ok
+
+    start = time.perf_counter()
+    if concurrent:
+        threads = [threading.Thread(target=timed, args=(url,)) for url in urls]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        for url in urls:
+            timed(url)
+    return time.perf_counter() - start, times, failures
+
+
+def bench_fresh(urls: list[str], download: bool, concurrent: bool, pool_size: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        opts = make_opts(Path(tmp))
+
+        def item(url: str) -> bool:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                return run_item(ydl, url, download)
+
+        return run_batch(urls, item, concurrent)
+
+
+def bench_pooled(urls: list[str], download: bool, concurrent: bool, pool_size: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = YoutubeDLPool(make_opts(Path(tmp)), size=pool_size)
+
+        def item(url: str) -> bool:
+            with pool.acquire(lambda d: None) as ydl:
+                return run_item(ydl, url, download)
+
+        try:
+            return run_batch(urls, item, concurrent)
+        finally:
+            pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("urls", type=Path, help="file with one URL per line")
+    parser.add_argument("--no-download", action="store_true", help="time extract_info only")
+    parser.add_argument("--concurrent", action="store_true", help="start all items at once, like the app")
+    parser.add_argument("--rounds", type=int, default=2, help="rounds, mode order alternates (default 2)")
+    parser.add_argument("--pool-size", type=int, default=3, help="pooled instances (default 3)")
+    args = parser.parse_args()
+
+    urls = [line.strip() for line in args.urls.read_text().splitlines() if line.strip()]
+    download = not args.no_download
+    modes = {"fresh": bench_fresh, "pooled": bench_pooled}
+    walls: dict[str, list[float]] = {name: [] for name in modes}
+    times: dict[str, list[float]] = {name: [] for name in modes}
+
+    for round_no in range(args.rounds):
+        order = list(modes) if round_no % 2 == 0 else list(reversed(modes))
+        for name in order:
+            wall, item_times, failures = modes[name](urls, download, args.concurrent, args.pool_size)
+            walls[name].append(wall)
+            times[name].extend(item_times)
+            print(f"round {round_no + 1} {name:>6}: {wall:.2f}s wall, {failures} failed")
+
+    n = len(urls)
+    print(f"items: {n}, rounds: {args.rounds}, download: {download}, concurrent: {args.concurrent}")
+    for name in modes:
+        print(f"{name:>7}: wall {statistics.mean(walls[name]) / n:.3f}s per item, "
+              f"item mean {statistics.mean(times[name]):.3f}s, median {statistics.median(times[name]):.3f}s")
+    saved = statistics.mean(walls["fresh"]) - statistics.mean(walls["pooled"])
+    print(f"  saved: {saved / n:.3f}s per item ({saved:.2f}s per batch)")
+
+
+if __name__ == "__main__":
+    main()
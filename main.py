@@ -1,11 +1,15 @@
 import flet as ft
 import yt_dlp
 import threading
+import weakref
 import re
 import os
+import shutil
+import glob
+from contextlib import contextmanager
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import Optional, Any
+from typing import Optional, Any, Callable
 
 
 @dataclass
@@ -20,20 +24,180 @@ class DownloadItem:
     cancel_flag: bool = False
 
 
+class InsufficientDiskSpace(Exception):
+    pass
+
+
+class DiskSpaceReservations:
+    """Tracks bytes still expected by running downloads against free disk space"""
+
+    def __init__(self, path: Path, margin: int = 100 * 1024 * 1024):
+        self.path = path
+        self.margin = margin
+        self._reserved: dict[object, int] = {}
+        self._admitted: dict[object, int] = {}
+        self._cond = threading.Condition()
+
+    def acquire(
+        self,
+        key: object,
+        size: int,
+        cancelled: Callable[[], bool],
+        on_wait: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Reserves size bytes for key, returns True if it had to wait for space"""
+        waited = False
+        with self._cond:
+            while True:
+                free = shutil.disk_usage(self.path).free
+                reserved = sum(self._reserved.values())
+                if reserved + size + self.margin <= free:
+                    break
+                # Would not fit even if every download in flight was dropped
+                if size + self.margin > free + reserved:
+                    raise InsufficientDiskSpace(size)
+                if cancelled():
+                    raise yt_dlp.utils.DownloadCancelled("Отменено пользователем")
+                if not waited and on_wait:
+                    on_wait()
+                waited = True
+                self._cond.wait(timeout=1)
+            self._reserved[key] = size
+            self._admitted[key] = size
+        return waited
+
+    def update(self, key: object, remaining: int):
+        # Bytes already on disk are reflected in free space, keep only the rest,
+        # never more than was admitted
+        with self._cond:
+            if key in self._reserved:
+                self._reserved[key] = min(max(remaining, 0), self._admitted[key])
+                self._cond.notify_all()
+
+    def release(self, key: object):
+        with self._cond:
+            self._admitted.pop(key, None)
+            if self._reserved.pop(key, None) is not None:
+                self._cond.notify_all()
+
+
+class YoutubeDLPool:
+    """Hands out at most size long-lived YoutubeDL instances at a time, so queued
+    downloads reuse their connections and player/signature caches"""
+
+    def __init__(self, opts: dict[str, Any], size: int = 3):
+        self.opts = opts
+        self.size = size
+        self._idle: list[yt_dlp.YoutubeDL] = []
+        self._hooks: dict[int, Callable[[dict[str, Any]], None]] = {}
+        self._broken: set[int] = set()
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create(self) -> yt_dlp.YoutubeDL:
+        ydl = None
+
+        def dispatch(d: dict[str, Any]):
+            hook = self._hooks.get(id(ydl))
+            if hook:
+                hook(d)
+
+        ydl = yt_dlp.YoutubeDL({**self.opts, 'progress_hooks': [dispatch]})
+        return ydl
+
+    @contextmanager
+    def acquire(
+        self,
+        progress_hook: Callable[[dict[str, Any]], None],
+        cancelled: Callable[[], bool] = lambda: False,
+        on_wait: Optional[Callable[[], None]] = None,
+    ):
+        """Blocks until one of the size slots is free, then yields an instance"""
+        waited = False
+        while not self._slots.acquire(timeout=1 if waited else 0):
+            if cancelled():
+                raise yt_dlp.utils.DownloadCancelled("Отменено пользователем")
+            if not waited and on_wait:
+                on_wait()
+            waited = True
+
+        try:
+            with self._lock:
+                ydl = self._idle.pop() if self._idle else None
+            if ydl is None:
+                ydl = self._create()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._hooks[id(ydl)] = progress_hook
+        try:
+            yield ydl
+        finally:
+            self._release(ydl)
+            self._slots.release()
+
+    @contextmanager
+    def transfer(self, ydl: yt_dlp.YoutubeDL):
+        """Wraps the download itself, an aborted transfer may leave a half-read
+        response behind so the instance is closed instead of reused"""
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self._broken.add(id(ydl))
+            raise
+
+    def _release(self, ydl: yt_dlp.YoutubeDL):
+        self._hooks.pop(id(ydl), None)
+        with self._lock:
+            broken = id(ydl) in self._broken
+            self._broken.discard(id(ydl))
+            if not broken and not self._closed and len(self._idle) < self.size:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+    def close(self):
+        """Closes idle instances, ones still in use are closed when released"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for ydl in idle:
+            ydl.close()
+
+
 class YouTubeDownloader:
     YOUTUBE_REGEX = re.compile(
         r'^(https?://)?(www\.)?(youtube\.com/(watch\?v=|shorts/)|youtu\.be/)[a-zA-Z0-9_-]{11}'
     )
 
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, staging_path: Optional[Path] = None):
         self.page = page
         self.items: dict[str, DownloadItem] = {}
         self.item_controls: dict[str, ft.Container] = {}
         self.download_path = Path.home() / "Downloads"
+        self.staging_path, staging_fallback = self._resolve_staging_path(staging_path)
+        self.disk = DiskSpaceReservations(self.staging_path)
+        self._clean_staging()
+        self._ydl_pool = YoutubeDLPool({
+            'format': 'best[ext=mp4]/best',
+            'outtmpl': "%(title)s.%(ext)s",
+            # Partial files stay in staging and are renamed into place when complete
+            'paths': {'home': str(self.download_path), 'temp': str(self.staging_path)},
+            'quiet': True,
+            'no_warnings': True,
+        })
+        # Also runs at exit, without keeping this downloader alive
+        weakref.finalize(self, self._ydl_pool.close)
 
         self._setup_page()
         self._build_ui()
 
+        if staging_fallback:
+            self._show_info_snackbar(f"Временная папка на другом диске, используется {self.staging_path}")
+
     def _setup_page(self):
         self.page.title = "YouTube Загрузчик"
         self.page.window.width = 700
@@ -55,6 +219,67 @@ class YouTubeDownloader:
             return "Некорректная ссылка YouTube"
         return None
 
+    def _resolve_staging_path(self, staging_path: Optional[Path]) -> tuple[Path, bool]:
+        """Picks the dir for partial files, returns it and whether it fell back.
+
+        Defaults to an app cache dir outside the download folder so watchers of
+        the download folder never see partial files. It must share a filesystem
+        with the download folder so finished files are moved by an atomic rename;
+        otherwise falls back to a hidden ".partial" dir inside the download folder,
+        which recursive watchers will still see (and which is not hidden on Windows).
+        """
+        if staging_path is None:
+            cache_root = os.environ.get("LOCALAPPDATA") if os.name == "nt" else None
+            staging_path = Path(cache_root or Path.home() / ".cache") / "youtube-downloader" / "partial"
+
+        try:
+            self.download_path.mkdir(parents=True, exist_ok=True)
+            staging_path.mkdir(parents=True, exist_ok=True)
+            same_device = staging_path.stat().st_dev == self.download_path.stat().st_dev
+        except OSError:
+            # Reported per item when the download tries to create it
+            return staging_path, False
+
+        if same_device:
+            return staging_path, False
+        return self.download_path / ".partial", True
+
+    def _clean_staging(self):
+        """Removes partial files left behind by a previous run"""
+        if not self.staging_path.is_dir():
+            return
+        for pattern in ("*.part", "*.part-Frag*", "*.ytdl"):
+            for leftover in self.staging_path.glob(pattern):
+                try:
+                    leftover.unlink()
+                except OSError:
+                    pass
+
+    def _remove_staged(self, staged: Optional[Path]):
+        """Removes an item's partial files after it was cancelled or failed"""
+        if staged is None:
+            return
+        for leftover in staged.parent.glob(glob.escape(staged.stem) + ".*"):
+            try:
+                leftover.unlink()
+            except OSError:
+                pass
+
+    def _prepare_paths(self):
+        self.download_path.mkdir(parents=True, exist_ok=True)
+        self.staging_path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _expected_size(info: dict[str, Any]) -> int:
+        """Expected bytes on disk, 0 (admitted without a reservation) if unknown"""
+        duration = info.get('duration') or 0
+        size = 0
+        for f in info.get('requested_formats') or [info]:
+            # tbr is in KBit/s
+            estimate = (f.get('tbr') or 0) * 1000 / 8 * duration
+            size += f.get('filesize') or f.get('filesize_approx') or int(estimate)
+        return size
+
     def _generate_id(self) -> str:
         import random
         import string
@@ -291,6 +516,9 @@ class YouTubeDownloader:
         item.title = "Получение информации..."
         self._update_item_ui(item_id)
 
+        # Unique per attempt, so a cancelled attempt still finishing can't drop a retry's reservation
+        reservation = object()
+
         def progress_hook(d: dict[str, Any]):
             if item.cancel_flag:
                 raise yt_dlp.utils.DownloadCancelled("Отменено пользователем")
@@ -303,39 +531,39 @@ class YouTubeDownloader:
 
                 if total:
                     item.progress = (downloaded / total) * 100
+                    self.disk.update(reservation, total - downloaded)
                 else:
                     item.progress = 0
 
                 filename = d.get('filename', '')
                 if filename and not item.title:
                     item.title = Path(filename).stem
-                    item.filename = filename
 
                 self.page.run_thread(lambda: self._update_item_ui(item_id))
 
             elif status == 'finished':
+                # filename here is still the staging path, the final one is set after post-processing
                 item.progress = 100
-                filename = d.get('filename', '')
-                if filename:
-                    item.filename = filename
-                    item.title = Path(filename).stem
                 self.page.run_thread(lambda: self._update_item_ui(item_id))
 
+        def show_queued():
+            item.title = "В очереди..."
+            self.page.run_thread(lambda: self._update_item_ui(item_id))
+
         def download():
-            # Ensure download path exists
-            self.download_path.mkdir(parents=True, exist_ok=True)
             output_template = str(self.download_path / "%(title)s.%(ext)s")
-
-            ydl_opts = {
-                'format': 'best[ext=mp4]/best',
-                'outtmpl': output_template,
-                'progress_hooks': [progress_hook],
-                'quiet': True,
-                'no_warnings': True,
-            }
+            staged: Optional[Path] = None
 
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                # Ensure download and staging paths exist
+                self._prepare_paths()
+
+                # Waits for a free instance, this is the slot the disk admission below guards
+                with self._ydl_pool.acquire(progress_hook, lambda: item.cancel_flag, show_queued) as ydl:
+                    if item.title == "В очереди...":
+                        item.title = "Получение информации..."
+                        self.page.run_thread(lambda: self._update_item_ui(item_id))
+
                     # Get info first
                     info = ydl.extract_info(item.url, download=False)
                     if info:
@@ -356,8 +584,23 @@ class YouTubeDownloader:
                         item.status = "cancelled"
                         return
 
-                    # Download
-                    ydl.download([item.url])
+                    def show_waiting():
+                        item.title = "Ожидание места на диске..."
+                        self.page.run_thread(lambda: self._update_item_ui(item_id))
+
+                    # Reserve expected size before starting, wait if other downloads hold the space
+                    if self.disk.acquire(reservation, self._expected_size(info), lambda: item.cancel_flag, show_waiting):
+                        item.title = info.get('title', 'Загрузка...')
+                        self.page.run_thread(lambda: self._update_item_ui(item_id))
+
+                    # Download from the already extracted info instead of extracting again
+                    staged = Path(ydl.prepare_filename(info, 'temp'))
+                    with self._ydl_pool.transfer(ydl):
+                        result = ydl.process_ie_result(info, download=True)
+
+                    # Final path after the file was moved out of staging
+                    downloaded = (result.get('requested_downloads') or [result])[-1]
+                    item.filename = downloaded.get('filepath') or ydl.prepare_filename(downloaded)
 
                 if item.status not in ["cancelled", "exists"]:
                     item.status = "completed"
@@ -365,8 +608,13 @@ class YouTubeDownloader:
 
             except yt_dlp.utils.DownloadCancelled:
                 item.status = "cancelled"
+                self._remove_staged(staged)
+            except InsufficientDiskSpace:
+                item.status = "error"
+                item.error = "Недостаточно места на диске"
             except Exception as ex:
                 item.status = "error"
+                self._remove_staged(staged)
                 error_msg = str(ex)
                 if "Sign in" in error_msg or "login" in error_msg.lower():
                     item.error = "Требуется авторизация в Chrome"
@@ -385,17 +633,21 @@ class YouTubeDownloader:
                     short_error = error_msg[:100] if len(error_msg) > 100 else error_msg
                     item.error = short_error
             finally:
+                self.disk.release(reservation)
                 self.page.run_thread(lambda: self._update_item_ui(item_id))
 
         threading.Thread(target=download, daemon=True).start()
 
     def _show_exists_snackbar(self, title: str):
+        self._show_info_snackbar(f"Файл уже скачан: {title[:40]}{'...' if len(title) > 40 else ''}")
+
+    def _show_info_snackbar(self, message: str):
         snack = ft.SnackBar(
             content=ft.Row(
                 [
                     ft.Icon(ft.Icons.INFO_OUTLINE, color="#FFFFFF", size=20),
                     ft.Text(
-                        f"Файл уже скачан: {title[:40]}{'...' if len(title) > 40 else ''}",
+                        message,
                         color="#FFFFFF",
                         size=14,
                     ),
@@ -679,7 +931,8 @@ class YouTubeDownloader:
 
 
 def main(page: ft.Page):
-    YouTubeDownloader(page)
+    staging_dir = os.environ.get("YOUTUBE_DOWNLOADER_STAGING_DIR")
+    YouTubeDownloader(page, Path(staging_dir).expanduser() if staging_dir else None)
 
 
 if __name__ == "__main__":